@@ -22,7 +22,7 @@ from keep.api.core.db import (
     update_key_last_used,
 )
 from keep.api.core.rbac import Admin as AdminRole
-from keep.api.core.rbac import get_role_by_role_name
+from keep.api.core.rbac import _authorize, get_role_by_role_name
 
 logger = logging.getLogger(__name__)
 
@@ -147,6 +147,7 @@ class AuthVerifierMultiTenant:
 
     def __init__(self, scopes: list[str] = []) -> None:
         self.scopes = scopes
+        self._scopes_key = tuple(sorted(scopes))
 
     def _verify_bearer_token(
         self, token: str = Depends(oauth2_scheme)
@@ -176,9 +177,8 @@ class AuthVerifierMultiTenant:
                     "keep_role", AdminRole.get_name()
                 )  # default to admin for backwards compatibility
                 email = payload.get("email")
-                role = get_role_by_role_name(role_name)
                 # validate scopes
-                if not role.has_scopes(self.scopes):
+                if not _authorize(role_name, self._scopes_key):
                     raise HTTPException(
                         status_code=403,
                         detail="You don't have the required permissions to access this resource",
@@ -228,8 +228,7 @@ class AuthVerifierMultiTenant:
             logger.debug("Successfully updated API Key last used")
 
         # validate scopes
-        role = get_role_by_role_name(tenant_api_key.role)
-        if not role.has_scopes(self.scopes):
+        if not _authorize(tenant_api_key.role, self._scopes_key):
             raise HTTPException(
                 status_code=403,
                 detail=f"You don't have the required scopes to access this resource [required scopes: {self.scopes}]",
@@ -286,6 +285,7 @@ class AuthVerifierSingleTenant:
 
     def __init__(self, scopes: list[str] = []) -> None:
         self.scopes = scopes
+        self._scopes_key = tuple(sorted(scopes))
 
     def _verify_api_key(
         self,
@@ -321,9 +321,8 @@ class AuthVerifierSingleTenant:
                 pass
             logger.debug("Successfully updated API Key last used")
 
-        role = get_role_by_role_name(tenant_api_key.role)
         # validate scopes
-        if not role.has_scopes(self.scopes):
+        if not _authorize(tenant_api_key.role, self._scopes_key):
             raise HTTPException(
                 status_code=403,
                 detail=f"You don't have the required scopes to access this resource [required scopes: {self.scopes}]",
@@ -367,11 +366,11 @@ class AuthVerifierSingleTenant:
             role_name = payload.get(
                 "role", AdminRole.get_name()
             )  # default to admin for backwards compatibility
-            role = get_role_by_role_name(role_name)
+            get_role_by_role_name(role_name)
         except Exception:
             raise HTTPException(status_code=401, detail="Invalid JWT token")
         # validate scopes
-        if not role.has_scopes(self.scopes):
+        if not _authorize(role_name, self._scopes_key):
             raise HTTPException(
                 status_code=403,
                 detail="You don't have the required permissions to access this resource",
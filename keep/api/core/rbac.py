@@ -13,31 +13,38 @@
 # TODO: implement a solid RBAC mechanism (probably OPA over Keycloak)
 
 
+import functools
+
 from fastapi import HTTPException
 
 
 class Role:
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # Precompute the lookup sets once per role so has_scopes doesn't
+        # rebuild them on every authorization check
+        cls._EXACT_SCOPES = frozenset(cls.SCOPES)
+        cls._WILDCARD_ACTIONS = frozenset(
+            scope.split(":", 1)[0] for scope in cls.SCOPES if scope.endswith(":*")
+        )
+
     @classmethod
     def get_name(cls):
         return cls.__name__.lower()
 
     @classmethod
     def has_scopes(cls, scopes: list[str]) -> bool:
-        required_scopes = set(scopes)
-        available_scopes = set(cls.SCOPES)
-
-        for scope in required_scopes:
+        for scope in scopes:
             # First, check if the scope is available
-            if scope in available_scopes:
+            if scope in cls._EXACT_SCOPES:
                 # Exact match, on to the next scope
                 continue
 
             # If not, check if there's a wildcard permission for this action
-            scope_parts = scope.split(":")
-            if len(scope_parts) != 2:
+            action, _, resource = scope.partition(":")
+            if not resource or ":" in resource:
                 return False  # Invalid scope format
-            action, resource = scope_parts
-            if f"{action}:*" not in available_scopes:
+            if action not in cls._WILDCARD_ACTIONS:
                 return False  # No wildcard permission for this action
         # All scopes are available
         return True
@@ -59,15 +66,31 @@ class Webhook(Role):
     SCOPES = ["write:alert"]
 
 
-def get_role_by_role_name(role_name: str) -> list[str]:
-    if role_name == "admin":
-        return Admin
-    elif role_name == "noc":
-        return Noc
-    elif role_name == "webhook":
-        return Webhook
-    else:
+_ROLES_BY_NAME: dict[str, type[Role]] = {
+    role.get_name(): role for role in (Admin, Noc, Webhook)
+}
+
+
+def get_role_by_role_name(role_name: str) -> type[Role]:
+    role = _ROLES_BY_NAME.get(role_name)
+    if role is None:
         raise HTTPException(
             status_code=403,
             detail=f"Role {role_name} not found",
         )
+    return role
+
+
+@functools.lru_cache(maxsize=4096)
+def _authorize(role_name: str, scopes_key: tuple[str, ...]) -> bool:
+    """
+    Cached authorization decision for a role and a set of required scopes.
+
+    Args:
+        role_name (str): The role name (e.g. "admin").
+        scopes_key (tuple[str, ...]): The required scopes, sorted.
+
+    Returns:
+        bool: True if the role has all the required scopes.
+    """
+    return get_role_by_role_name(role_name).has_scopes(list(scopes_key))
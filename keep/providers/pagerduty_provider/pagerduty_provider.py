@@ -1,11 +1,18 @@
+import collections
+import concurrent.futures
 import dataclasses
 import datetime
 import json
+import math
+import time
 import typing
 import uuid
+from types import MappingProxyType
 
 import pydantic
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from keep.api.models.alert import AlertDto, AlertSeverity, AlertStatus
 from keep.contextmanager.contextmanager import ContextManager
@@ -17,6 +24,25 @@ from keep.providers.providers_factory import ProvidersFactory
 # Todo: think about splitting in to PagerdutyIncidentsProvider and PagerdutyAlertsProvider
 # Read this: https://community.pagerduty.com/forum/t/create-incident-using-python/3596/3
 
+# shared read-only default for nested lookups, so we don't allocate a new {} per field
+_EMPTY = MappingProxyType({})
+
+# incident events Keep subscribes to when setting up the webhook
+_WEBHOOK_EVENTS = (
+    "incident.acknowledged",
+    "incident.annotated",
+    "incident.delegated",
+    "incident.escalated",
+    "incident.priority_updated",
+    "incident.reassigned",
+    "incident.reopened",
+    "incident.resolved",
+    "incident.responder.added",
+    "incident.responder.replied",
+    "incident.triggered",
+    "incident.unacknowledged",
+)
+
 
 @pydantic.dataclasses.dataclass
 class PagerdutyProviderAuthConfig:
@@ -69,6 +95,8 @@ class PagerdutyProvider(BaseProvider):
         ),
     ]
     SUBSCRIPTION_API_URL = "https://api.pagerduty.com/webhook_subscriptions"
+    INCIDENTS_API_URL = "https://api.pagerduty.com/incidents"
+    EVENTS_API_URL = "https://events.pagerduty.com/v2/enqueue"
     PROVIDER_DISPLAY_NAME = "PagerDuty"
     SEVERITIES_MAP = {
         "P1": AlertSeverity.CRITICAL,
@@ -81,47 +109,65 @@ class PagerdutyProvider(BaseProvider):
         "acknowledged": AlertStatus.ACKNOWLEDGED,
         "resolved": AlertStatus.RESOLVED,
     }
+    MAX_INCIDENTS = 1000
+    INCIDENTS_PAGE_SIZE = 100
+    INCIDENTS_BASE_PARAMS = MappingProxyType(
+        {"limit": INCIDENTS_PAGE_SIZE, "sort_by": "created_at:desc"}
+    )
+    # PagerDuty rate limits the REST API, keep concurrent pagination around 10 RPS
+    INCIDENTS_FETCH_WORKERS = 5
+    INCIDENTS_FETCH_INTERVAL = 0.1
 
     def __init__(
         self, context_manager: ContextManager, provider_id: str, config: ProviderConfig
     ):
         super().__init__(context_manager, provider_id, config)
+        # reuse connections across calls instead of a new TCP+TLS handshake per request
+        self._session = requests.Session()
+        self._session.mount(
+            "https://",
+            HTTPAdapter(
+                pool_connections=4,
+                pool_maxsize=16,
+                max_retries=Retry(
+                    total=3,
+                    backoff_factor=0.3,
+                    status_forcelist=[429, 502, 503, 504],
+                ),
+            ),
+        )
+        self._session.headers.update(self._auth_headers)
 
     def validate_config(self):
         self.authentication_config = PagerdutyProviderAuthConfig(
             **self.config.authentication
         )
-        if (
-            not self.authentication_config.routing_key
-            and not self.authentication_config.api_key
-        ):
+        # cache the keys on the instance, they are read on every request
+        self._api_key = self.authentication_config.api_key
+        self._routing_key = self.authentication_config.routing_key
+        if not self._routing_key and not self._api_key:
             raise ProviderConfigException(
                 "PagerdutyProvider requires either routing_key or api_key",
                 provider_id=self.provider_id,
             )
-        
+        # formatted once and sent with every request through the session
+        self._auth_token = f"Token token={self._api_key}" if self._api_key else None
+        self._auth_headers = {"Accept": "application/json"}
+        if self._auth_token:
+            self._auth_headers["Authorization"] = self._auth_token
+
     def validate_scopes(self):
         """
         Validate that the provider has the required scopes.
         """
-        headers = {
-            "Accept": "application/json",
-            "Authorization": f"Token token={self.authentication_config.api_key}",
-        }
         scopes = {}
         for scope in self.PROVIDER_SCOPES:
             try:
                 # Todo: how to check validity for write scopes?
                 if scope.name.startswith("incidents"):
-                    response = requests.get(
-                        "https://api.pagerduty.com/incidents",
-                        headers=headers,
-                    )
+                    response = self._session.get(self.INCIDENTS_API_URL)
                 elif scope.name.startswith("webhook_subscriptions"):
-                    response = requests.get(
-                        self.SUBSCRIPTION_API_URL,
-                        headers=headers,
-                    )
+                    response = self._session.get(self.SUBSCRIPTION_API_URL)
                 if response.ok:
                     scopes[scope.name] = True
                 else:
@@ -146,7 +192,7 @@ class PagerdutyProvider(BaseProvider):
             Dictionary of alert body for JSON serialization
         """
         return {
-            "routing_key": self.authentication_config.routing_key,
+            "routing_key": self._routing_key,
             "event_action": "trigger",
             "dedup_key": dedup,
             "payload": {
@@ -172,9 +218,9 @@ class PagerdutyProvider(BaseProvider):
         if dedup is None:
             dedup = str(datetime.datetime.now().timestamp())
 
-        url = "https://events.pagerduty.com//v2/enqueue"
-
-        result = requests.post(url, json=self._build_alert(title, body, dedup))
+        result = self._session.post(
+            self.EVENTS_API_URL, json=self._build_alert(title, body, dedup)
+        )
 
         self.logger.debug("Alert status: %s", result.status_code)
         self.logger.debug("Alert response: %s", result.text)
@@ -191,13 +237,11 @@ class PagerdutyProvider(BaseProvider):
         """Triggers an incident via the V2 REST API using sample data."""
 
         if not incident_key:
-            incident_key = str(uuid.uuid4()).replace("-", "")
+            incident_key = uuid.uuid4().hex
 
-        url = "https://api.pagerduty.com/incidents"
         headers = {
             "Content-Type": "application/json",
             "Accept": "application/vnd.pagerduty+json;version=2",
-            "Authorization": f"Token token={self.authentication_config.api_key}",
             "From": requester,
         }
 
@@ -211,37 +255,31 @@ class PagerdutyProvider(BaseProvider):
             }
         }
 
-        r = requests.post(url, headers=headers, data=json.dumps(payload))
+        r = self._session.post(
+            self.INCIDENTS_API_URL, headers=headers, data=json.dumps(payload)
+        )
 
         print(f"Status Code: {r.status_code}")
-        print(r.json())
-        return r.json()
+        response = r.json()
+        print(response)
+        return response
 
     def dispose(self):
         """
-        No need to dispose of anything, so just do nothing.
+        Closes the pooled HTTP session.
         """
-        pass
+        self._session.close()
 
     def setup_webhook(
         self, tenant_id: str, keep_api_url: str, api_key: str, setup_alerts: bool = True
     ):
         self.logger.info("Setting up Pagerduty webhook")
-        headers = {"Authorization": f"Token token={self.authentication_config.api_key}"}
-        request = requests.get(self.SUBSCRIPTION_API_URL, headers=headers)
-        if not request.ok:
-            raise Exception("Could not get existing webhooks")
-        existing_webhooks = request.json().get("webhook_subscriptions", [])
-        webhook_exists = next(
-            iter(
-                [
-                    webhook
-                    for webhook in existing_webhooks
-                    if tenant_id in webhook.get("description")
-                ]
-            ),
-            False,
-        )
+        webhook_description = f"Keep Pagerduty webhook ({tenant_id}) - do not change"
+        existing_webhooks = {
+            webhook.get("description"): webhook
+            for webhook in self._get_webhook_subscriptions()
+        }
+        webhook_exists = existing_webhooks.get(webhook_description)
         webhook_payload = {
             "webhook_subscription": {
                 "type": "webhook_subscription",
@@ -250,38 +288,30 @@ class PagerdutyProvider(BaseProvider):
                     "url": keep_api_url,
                     "custom_headers": [{"name": "X-API-KEY", "value": api_key}],
                 },
-                "description": f"Keep Pagerduty webhook ({tenant_id}) - do not change",
-                "events": [
-                    "incident.acknowledged",
-                    "incident.annotated",
-                    "incident.delegated",
-                    "incident.escalated",
-                    "incident.priority_updated",
-                    "incident.reassigned",
-                    "incident.reopened",
-                    "incident.resolved",
-                    "incident.responder.added",
-                    "incident.responder.replied",
-                    "incident.triggered",
-                    "incident.unacknowledged",
-                ],
+                "description": webhook_description,
+                "events": list(_WEBHOOK_EVENTS),
                 "filter": {"type": "account_reference"},
             },
         }
         if webhook_exists:
+            if self._webhook_up_to_date(
+                webhook_exists, webhook_payload["webhook_subscription"]
+            ):
+                self.logger.info(
+                    "Webhook already exists and is up to date",
+                    extra={"webhook_id": webhook_exists.get("id")},
+                )
+                return
             self.logger.info("Webhook already exists, removing and re-creating")
             webhook_id = webhook_exists.get("id")
-            request = requests.delete(
-                f"{self.SUBSCRIPTION_API_URL}/{webhook_id}", headers=headers
-            )
+            request = self._session.delete(f"{self.SUBSCRIPTION_API_URL}/{webhook_id}")
             if not request.ok:
                 raise Exception("Could not remove existing webhook")
             self.logger.info("Webhook removed", extra={"webhook_id": webhook_id})
 
         self.logger.info("Creating Pagerduty webhook")
-        request = requests.post(
+        request = self._session.post(
             self.SUBSCRIPTION_API_URL,
-            headers=headers,
             json=webhook_payload,
         )
         if not request.ok:
@@ -289,49 +319,117 @@ class PagerdutyProvider(BaseProvider):
             raise Exception("Could not create webhook")
         self.logger.info("Webhook created")
 
-    def _get_alerts(self) -> list[AlertDto]:
-        request = requests.get(
-            "https://api.pagerduty.com/incidents",
-            headers={
-                "Authorization": f"Token token={self.authentication_config.api_key}",
-            },
+    def _get_webhook_subscriptions(self) -> list[dict]:
+        webhooks = []
+        params = {"total": "true", "offset": 0}
+        while True:
+            request = self._session.get(self.SUBSCRIPTION_API_URL, params=params)
+            if not request.ok:
+                raise Exception("Could not get existing webhooks")
+            response = request.json()
+            new_webhooks = response.get("webhook_subscriptions", [])
+            webhooks.extend(new_webhooks)
+            if response.get("more") is not True or not new_webhooks:
+                return webhooks
+            # offset is where the returned page started, step a full page past it
+            params["offset"] = (response.get("offset") or 0) + (
+                response.get("limit") or len(new_webhooks)
+            )
+
+    @staticmethod
+    def _webhook_up_to_date(existing_webhook: dict, webhook: dict) -> bool:
+        """
+        Check whether an existing webhook subscription matches the one we'd create.
+        Header values PagerDuty doesn't echo back won't match, so those get re-created.
+        """
+        existing_delivery_method = existing_webhook.get("delivery_method") or _EMPTY
+        delivery_method = webhook["delivery_method"]
+        return (
+            existing_delivery_method.get("url") == delivery_method["url"]
+            and existing_delivery_method.get("custom_headers")
+            == delivery_method["custom_headers"]
+            and frozenset(existing_webhook.get("events") or ())
+            == frozenset(webhook["events"])
         )
+
+    def _get_incidents_page(self, offset: int, total: bool = False) -> dict:
+        params = {**self.INCIDENTS_BASE_PARAMS, "offset": offset}
+        if total:
+            params["total"] = "true"
+        request = self._session.get(self.INCIDENTS_API_URL, params=params)
         if not request.ok:
             self.logger.error("Failed to get alerts", extra=request.json())
             raise Exception("Could not get alerts")
-        incidents = request.json().get("incidents", [])
-        incidents = [
-            self._format_alert({"event": {"data": incident}}) for incident in incidents
-        ]
-        return incidents
+        return request.json()
+
+    def _paginate_incidents(self) -> typing.Iterator[list[dict]]:
+        """
+        Yield pages of raw incidents in offset order.
+        """
+        # the first page tells us how many incidents there are,
+        # the rest of the pages can then be fetched concurrently
+        response = self._get_incidents_page(0, total=True)
+        yield response.get("incidents", [])
+        if response.get("more") is not True:
+            return
+        # PagerDuty may cap the page size below what we asked for,
+        # step by the limit it actually applied so pages don't overlap
+        page_size = response.get("limit") or self.INCIDENTS_PAGE_SIZE
+        total = min(response.get("total") or self.MAX_INCIDENTS, self.MAX_INCIDENTS)
+        pages = math.ceil(total / page_size)
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.INCIDENTS_FETCH_WORKERS
+        ) as executor:
+            futures = collections.deque()
+            for page in range(1, pages):
+                futures.append(
+                    executor.submit(self._get_incidents_page, page * page_size)
+                )
+                time.sleep(self.INCIDENTS_FETCH_INTERVAL)
+            try:
+                # pop each page as it's consumed so its raw incidents can be freed
+                while futures:
+                    yield futures.popleft().result().get("incidents", [])
+            finally:
+                # the caller stopped early, don't wait on pages nobody will read
+                for future in futures:
+                    future.cancel()
+
+    def _get_alerts(self) -> list[AlertDto]:
+        alerts = []
+        format_alert = self._format_alert
+        for incidents in self._paginate_incidents():
+            # format per page so raw incidents and alerts are never all held at once
+            for incident in incidents[: self.MAX_INCIDENTS - len(alerts)]:
+                alerts.append(format_alert({"event": {"data": incident}}))
+            if len(alerts) >= self.MAX_INCIDENTS:
+                break
+        return alerts
 
     @staticmethod
     def _format_alert(
         event: dict, provider_instance: typing.Optional["PagerdutyProvider"] = None
     ) -> AlertDto:
-        actual_event = event.get("event", {})
+        actual_event = event.get("event") or _EMPTY
         data = actual_event.get("data", {})
         url = data.pop("self", data.pop("html_url"))
         # format status and severity to Keep format
-        status = PagerdutyProvider.STATUS_MAP.get(
-            data.pop("status"), AlertStatus.FIRING
-        )
-        priority_summary = (data.get("priority", {}) or {}).get("summary")
-        priority = PagerdutyProvider.SEVERITIES_MAP.get(
-            priority_summary, AlertSeverity.INFO
-        )
+        status_map = PagerdutyProvider.STATUS_MAP
+        severities_map = PagerdutyProvider.SEVERITIES_MAP
+        status = status_map.get(data.pop("status", None), AlertStatus.FIRING)
+        raw_priority = data.get("priority")
+        priority_summary = raw_priority.get("summary") if raw_priority else None
+        priority = severities_map.get(priority_summary, AlertSeverity.INFO)
         last_received = data.pop("created_at")
         name = data.pop("title")
-        service = data.pop("service", {}).get("summary", "unknown")
+        service = (data.pop("service", None) or _EMPTY).get("summary", "unknown")
         environment = next(
-            iter(
-                [
-                    x
-                    for x in data.pop("custom_fields", [])
-                    if x.get("name") == "environment"
-                ]
+            (
+                x
+                for x in data.pop("custom_fields", None) or ()
+                if x.get("name") == "environment"
             ),
-            {},
+            _EMPTY,
         ).get("value", "unknown")
         return AlertDto(
             **data,
@@ -363,7 +461,7 @@ class PagerdutyProvider(BaseProvider):
         Args:
             kwargs (dict): The providers with context
         """
-        if self.authentication_config.routing_key:
+        if self._routing_key:
             return self._send_alert(title, alert_body, dedup=dedup, **kwargs)
         else:
             return self._trigger_incident(